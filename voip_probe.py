@@ -15,16 +15,46 @@ Usage examples:
 """
 
 import argparse
-import csv
+import ctypes
+import ctypes.util
+import errno
+import math
+import os
+import queue
+import selectors
 import socket
 import struct
 import sys
+import threading
 import time
+from array import array
 from datetime import datetime, timezone
-from collections import deque
 
 PKT_STRUCT = struct.Struct("!I Q I")  # seq, timestamp_ns, magic
+SEQ_TS_STRUCT = struct.Struct("!I Q")  # PKT_STRUCT prefix rewritten per send
 MAGIC = 0xABCD1357
+RECV_BUF_SIZE = 2048
+# Kernel socket buffers. Linux silently caps these at net.core.rmem_max /
+# wmem_max, so bursty high-pps runs may also need e.g.
+#   sysctl -w net.core.rmem_max=8388608 net.core.wmem_max=8388608
+SOCK_BUF_BYTES = 8 << 20
+
+# Server batching (Linux): up to MMSG_BATCH datagrams per recvmmsg/sendmmsg.
+MMSG_BATCH = 64
+MMSG_ADDR_SIZE = 128  # sizeof(struct sockaddr_storage)
+MSG_WAITFORONE = 0x10000
+
+CSV_HEADER = ("ts_utc,seq,rtt_ms,oneway_ms_est,jitter_ms,"
+              "loss_pct_window,mos,r_factor,Id,Ie_eff")
+# row tuple: (wall_ts, seq, rtt_ms, oneway_ms, jitter_ms, loss_pct, mos_cols)
+CSV_ROW_FMT = "%s,%d,%.3f,%.3f,%.3f,%.3f,%s\n"
+CSV_FLUSH_ROWS = 1024
+# rows allowed to wait for the writer thread before new ones are dropped
+CSV_MAX_BACKLOG = 64 * CSV_FLUSH_ROWS
+
+# rfc3550: EWMA J += (|D| - J)/16; running: mean |D| over the whole run;
+# interval: mean |D| since the last report.
+JITTER_ALGOS = ("rfc3550", "running", "interval")
 
 CODEC_PARAMS = {
     "g711": (0.0, 25.0),  # (Ie, Bpl)
@@ -32,21 +62,15 @@ CODEC_PARAMS = {
     "opus": (5.0, 14.0),
 }
 
-def now_ns():
-    return time.time_ns()
-
-def iso_now():
-    return datetime.now(timezone.utc).isoformat()
-
-def hstep(x):
-    return 1.0 if x > 0 else 0.0
-
 def emodel_mos(delay_ms, loss_percent, codec="g711", burstR=1.0):
     Ie, Bpl = CODEC_PARAMS.get(codec.lower(), CODEC_PARAMS["g711"])
     d = max(0.0, float(delay_ms))
     Ppl = max(0.0, float(loss_percent))
+    return emodel_mos_core(d, Ppl, Ie, Bpl, burstR)
 
-    Id = 0.024*d + 0.11*(d - 177.3)*hstep(d - 177.3)
+def emodel_mos_core(d, Ppl, Ie, Bpl, burstR):
+    """E-model on pre-validated floats and resolved codec params (hot path)."""
+    Id = 0.024*d + (0.11*(d - 177.3) if d > 177.3 else 0.0)
 
     if Ppl > 0:
         Ie_eff = Ie + (95.0 - Ie) * Ppl / (Ppl/Bpl + burstR)
@@ -60,158 +84,426 @@ def emodel_mos(delay_ms, loss_percent, codec="g711", burstR=1.0):
     elif R >= 100:
         mos = 4.5
     else:
+        # the cubic peaks just under 4.5 on (0, 100); only the low end needs clamping
         mos = 1 + 0.035*R + (R*(R-60)*(100-R))*7e-6
-        mos = max(1.0, min(4.5, mos))
+        if mos < 1.0:
+            mos = 1.0
 
     return mos, R, Id, Ie_eff
 
-def rfc3550_jitter_update(J_prev, diff_ms):
-    return J_prev + (abs(diff_ms) - J_prev) / 16.0
+def percentiles(samples, qs):
+    """Nearest-rank percentiles of samples for each q in qs (0-100)."""
+    ordered = sorted(samples)
+    if not ordered:
+        return [0.0 for _ in qs]
+    n = len(ordered)
+    return [ordered[max(0, -(-q*n // 100) - 1)] for q in qs]
+
+def write_csv_rows(f, rows):
+    """Format a batch of raw row tuples and write them with one call."""
+    fromts = datetime.fromtimestamp
+    utc = timezone.utc
+    f.write("".join([
+        CSV_ROW_FMT % (fromts(ts, utc).isoformat(), seq, rtt, owd, jit, loss, mos_cols)
+        for ts, seq, rtt, owd, jit, loss, mos_cols in rows
+    ]))
+
+def csv_writer_loop(f, rowq, errors):
+    """Writer thread: drain rowq in batches of up to CSV_FLUSH_ROWS until None.
+    A write error is appended to errors and ends the thread."""
+    get, get_nowait = rowq.get, rowq.get_nowait
+    try:
+        while True:
+            batch = [get()]
+            try:
+                while len(batch) < CSV_FLUSH_ROWS:
+                    batch.append(get_nowait())
+            except queue.Empty:
+                pass
+            done = batch[-1] is None
+            if done:
+                batch.pop()
+            write_csv_rows(f, batch)
+            if done:
+                return
+    except OSError as err:
+        errors.append(err)
+
+def ring_tail(buf, idx, n):
+    """Last n values written to ring buf whose next write index is idx (unordered)."""
+    if n <= idx:
+        return buf[idx-n:idx]
+    return buf[idx-n:] + buf[:idx]
+
+class _Iovec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p), ("iov_len", ctypes.c_size_t)]
+
+class _Msghdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_name", ctypes.c_void_p), ("msg_namelen", ctypes.c_uint32),
+        ("msg_iov", ctypes.POINTER(_Iovec)), ("msg_iovlen", ctypes.c_size_t),
+        ("msg_control", ctypes.c_void_p), ("msg_controllen", ctypes.c_size_t),
+        ("msg_flags", ctypes.c_int),
+    ]
+
+class _Mmsghdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", _Msghdr), ("msg_len", ctypes.c_uint)]
+
+def load_mmsg():
+    """Return libc with recvmmsg/sendmmsg prototyped, or None if unavailable."""
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        recvmmsg, sendmmsg = libc.recvmmsg, libc.sendmmsg
+    except (OSError, AttributeError):
+        return None
+    recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(_Mmsghdr), ctypes.c_uint,
+                         ctypes.c_int, ctypes.c_void_p]
+    sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(_Mmsghdr), ctypes.c_uint, ctypes.c_int]
+    recvmmsg.restype = sendmmsg.restype = ctypes.c_int
+    return libc
+
+def echo_loop(sock):
+    buf = bytearray(RECV_BUF_SIZE)
+    mv = memoryview(buf)
+    while True:
+        n, addr = sock.recvfrom_into(buf)
+        sock.sendto(mv[:n], addr)
+
+def echo_mmsg(sock, libc):
+    """Echo datagrams in batches: one recvmmsg drains up to MMSG_BATCH packets
+    (blocking for the first only), one sendmmsg returns them to their sources."""
+    data = ctypes.create_string_buffer(RECV_BUF_SIZE * MMSG_BATCH)
+    names = ctypes.create_string_buffer(MMSG_ADDR_SIZE * MMSG_BATCH)
+    iovs = (_Iovec * MMSG_BATCH)()
+    msgs = (_Mmsghdr * MMSG_BATCH)()
+    for i in range(MMSG_BATCH):
+        iovs[i].iov_base = ctypes.addressof(data) + i*RECV_BUF_SIZE
+        iovs[i].iov_len = RECV_BUF_SIZE
+        hdr = msgs[i].msg_hdr
+        hdr.msg_name = ctypes.addressof(names) + i*MMSG_ADDR_SIZE
+        hdr.msg_namelen = MMSG_ADDR_SIZE
+        hdr.msg_iov = ctypes.pointer(iovs[i])
+        hdr.msg_iovlen = 1
+
+    fd = sock.fileno()
+    recvmmsg, sendmmsg = libc.recvmmsg, libc.sendmmsg
+    while True:
+        n = recvmmsg(fd, msgs, MMSG_BATCH, MSG_WAITFORONE, None)
+        if n < 0:
+            err = ctypes.get_errno()
+            if err == errno.EINTR:
+                continue
+            raise OSError(err, os.strerror(err))
+
+        # msg_name/msg_namelen already hold each sender; trim iovs to payload
+        for i in range(n):
+            iovs[i].iov_len = msgs[i].msg_len
+        sent = 0
+        while sent < n:
+            r = sendmmsg(fd, ctypes.byref(msgs[sent]), n - sent, 0)
+            if r < 0:
+                if ctypes.get_errno() != errno.EINTR:
+                    sent += 1  # drop the datagram sendmmsg choked on
+                continue
+            sent += r
+        for i in range(n):
+            iovs[i].iov_len = RECV_BUF_SIZE
+            msgs[i].msg_hdr.msg_namelen = MMSG_ADDR_SIZE
+
+def tune_socket(sock):
+    for opt in (socket.SO_RCVBUF, socket.SO_SNDBUF):
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, opt, SOCK_BUF_BYTES)
+        except OSError as err:
+            print("setsockopt error:", err)
+
+def tune_process(cpu):
+    """Pin to one CPU if requested and try to raise priority (needs privileges)."""
+    if cpu is not None:
+        if hasattr(os, "sched_setaffinity"):
+            try:
+                os.sched_setaffinity(0, {cpu})
+            except OSError as err:
+                print("cpu affinity error:", err)
+        else:
+            print("cpu affinity not supported on this platform")
+    try:
+        os.nice(-10)
+    except (AttributeError, OSError):
+        pass
 
-def run_server(bind, port):
+def run_server(bind, port, cpu=None):
+    tune_process(cpu)
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    tune_socket(sock)
     sock.bind((bind, port))
-    print(f"[server] listening on {bind}:{port}")
+    libc = load_mmsg()
+    mode = f"recvmmsg batch={MMSG_BATCH}" if libc else "recvfrom"
+    print(f"[server] listening on {bind}:{port} ({mode})")
     try:
-        while True:
-            data, addr = sock.recvfrom(2048)
-            sock.sendto(data, addr)
+        if libc:
+            echo_mmsg(sock, libc)
+        else:
+            echo_loop(sock)
     except KeyboardInterrupt:
         pass
     finally:
         print("[server] shutting down")
         sock.close()
 
-def run_client(host, port, pps, duration, csv_path, codec, burstR, warmup, report_every, timeout_ms):
+def run_client(host, port, pps, duration, csv_path, codec, burstR, warmup, report_every, timeout_ms,
+               cpu=None, mos_interval=1.0, jitter_algo="rfc3550"):
+    tune_process(cpu)
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    sock.settimeout(timeout_ms/1000)
-    interval_s = 1.0 / float(pps)
-
-    sent_times = {}
-    received = set()
-    rtt_samples = []
-    oneway_samples = []
-    window = deque(maxlen=max(pps*10, 100))
-    last_transit_ms = None
-    J_ms = 0.0
+    tune_socket(sock)
+    # connected UDP: the kernel caches the route, send/recv skip the address
+    sock.connect((host, port))
+    sock.setblocking(False)
+    sel = selectors.DefaultSelector()
+    sel.register(sock, selectors.EVENT_READ)
+    max_wait = timeout_ms/1000
+    interval_ns = round(1e9 / pps)
+    Ie, Bpl = CODEC_PARAMS[codec.lower()]
+
+    # Sliding loss window: one slot per seq (seq % win_size) holding its send
+    # stamp (-1 = empty) and a received flag, with running counters so loss
+    # and RTT lookup are O(1) and memory does not grow with runtime.
+    win_size = max(pps*10, 100)
+    sent_ns = array("q", [-1]) * win_size
+    recv_bits = bytearray(win_size)
+    sent_in_window = recv_in_window = 0
+
+    # RTT history: running (Welford) mean for the report, plus a ring of the
+    # last win_size samples for percentiles and the recent OWD average.
+    rtt_mean = 0.0
+    rtt_buf = array("d", [0.0]) * win_size
+    rtt_idx = 0
+    # RFC 3550 jitter J += (|D| - J)/16, kept in integer ns as fixed point.
+    # |D| is also summed (running/interval means) and kept in a ring for
+    # the report percentiles.
+    last_transit_ns = None
+    J_ns = 0
+    ewma_jitter = jitter_algo == "rfc3550"
+    reset_jitter = jitter_algo == "interval"
+    d_sum = d_count = 0
+    d_buf = array("q", [0]) * win_size
+    d_idx = d_total = 0
 
     total_sent = total_recv = 0
     seq = 0
 
-    csv_writer = None
+    # The receive path only queues raw tuples; formatting and disk writes
+    # happen on a writer thread so file I/O cannot stall socket draining.
+    # The backlog is capped via qsize() (SimpleQueue stays lock-free) and a
+    # writer error aborts the run.
     csv_file = None
+    csv_thread = None
+    csv_errors = []
+    csv_dropped = 0
+    rowq = queue.SimpleQueue()
     if csv_path:
-        csv_file = open(csv_path, "w", newline="")
-        csv_writer = csv.writer(csv_file)
-        csv_writer.writerow([
-            "ts_utc","seq","rtt_ms","oneway_ms_est","jitter_ms",
-            "loss_pct_window","mos","r_factor","Id","Ie_eff"
-        ])
+        csv_file = open(csv_path, "w", buffering=1 << 20)
+        csv_file.write(CSV_HEADER + "\n")
+        csv_thread = threading.Thread(target=csv_writer_loop, args=(csv_file, rowq, csv_errors),
+                                      name="csv-writer", daemon=True)
+        csv_thread.start()
+    put_row = rowq.put
+    csv_backlog = rowq.qsize
+    wall_time = time.time
 
     print(f"[client] sending to {host}:{port} @ {pps} pps (codec={codec})")
     if duration:
         print(f"[client] duration: {duration}s")
 
-    start = time.time()
-    next_send = time.time()
-    next_report = time.time() + report_every
-    server_addr = (host, port)
+    # Scheduling and probe stamps both use the monotonic clock: RTT is a
+    # difference of two local stamps, so wall-clock steps must not leak in.
+    monotonic_ns = time.monotonic_ns
+    # outgoing probe template: magic is filled once, seq/stamp rewritten in place
+    pkt = bytearray(PKT_STRUCT.size)
+    PKT_STRUCT.pack_into(pkt, 0, 0, 0, MAGIC)
+    pack_seq_ts = SEQ_TS_STRUCT.pack_into
+    unpack_from = PKT_STRUCT.unpack_from
+    pkt_size = PKT_STRUCT.size
+    report_ns = report_every * 1_000_000_000
+    warmup_ns = warmup * 1_000_000_000
+    end_ns = None
+
+    start_ns = monotonic_ns()
+    if duration:
+        end_ns = start_ns + duration * 1_000_000_000
+    next_send_ns = start_ns
+    next_report_ns = start_ns + report_ns
+    # CSV MOS columns are recomputed every mos_interval once warmup is over
+    # and repeated in between.
+    mos_interval_ns = int(mos_interval * 1e9)
+    next_mos_ns = start_ns + warmup_ns
+    mos_cols = ",,,"
+    buf = bytearray(RECV_BUF_SIZE)
 
     try:
         while True:
-            now = time.time()
+            now_ns = monotonic_ns()
 
-            if duration and (now - start) >= duration:
+            if end_ns and now_ns >= end_ns:
                 break
 
-            if now >= next_send:
-                send_ns = now_ns()
-                packet = PKT_STRUCT.pack(seq, send_ns, MAGIC)
+            # drain everything queued; EAGAIN ends the batch
+            while True:
                 try:
-                    sock.sendto(packet, server_addr)
-                    sent_times[seq] = send_ns
-                    window.append(seq)
-                    total_sent += 1
-                except Exception as err:
-                    print("send error:", err)
-                seq = (seq + 1) & 0xffffffff
-                next_send += interval_s
-
-            try:
-                data, _ = sock.recvfrom(2048)
-                recv_ns = now_ns()
-                if len(data) >= PKT_STRUCT.size:
-                    r_seq, s_ns, magic = PKT_STRUCT.unpack(data[:PKT_STRUCT.size])
-                    if magic != MAGIC:
-                        continue
-                    if r_seq in received:
-                        continue
-                    received.add(r_seq)
-                    if r_seq in sent_times:
-                        rtt_ms = (recv_ns - sent_times[r_seq]) / 1e6
-                        oneway_ms = rtt_ms / 2.0
-                        rtt_samples.append(rtt_ms)
-                        oneway_samples.append(oneway_ms)
-                        total_recv += 1
-
-                        transit_ms = (recv_ns - s_ns) / 1e6
-                        if last_transit_ms is not None:
-                            J_ms = rfc3550_jitter_update(J_ms, transit_ms - last_transit_ms)
-                        last_transit_ms = transit_ms
-
-                        win = list(window)
-                        recv_win = sum(1 for w in win if w in received)
-                        loss_pct = 100*(len(win)-recv_win)/len(win) if win else 0.0
-
-                        elapsed = time.time() - start
-                        if elapsed > warmup and len(oneway_samples) > 2:
-                            avg_oneway = sum(oneway_samples[-pps:]) / max(1, min(len(oneway_samples),pps))
-                            mos,R,Id,Ie_eff = emodel_mos(avg_oneway, loss_pct, codec, burstR)
-                        else:
-                            mos = R = Id = Ie_eff = None
-
-                        if csv_writer:
-                            csv_writer.writerow([
-                                iso_now(), r_seq,
-                                round(rtt_ms,3), round(oneway_ms,3),
-                                round(J_ms,3), round(loss_pct,3),
-                                round(mos,3) if mos else "",
-                                round(R,1) if R else "",
-                                round(Id,3) if Id else "",
-                                round(Ie_eff,3) if Ie_eff else ""
-                            ])
-
-            except socket.timeout:
-                pass
-
-            if now >= next_report:
-                elapsed = max(1e-9, now-start)
-                avg_rtt = sum(rtt_samples)/len(rtt_samples) if rtt_samples else 0.0
-                avg_oneway = sum(oneway_samples)/len(oneway_samples) if oneway_samples else 0.0
+                    n = sock.recv_into(buf)
+                except BlockingIOError:
+                    break
+                except ConnectionRefusedError:
+                    continue  # ICMP port unreachable for an earlier probe
+                recv_ns = monotonic_ns()
+                if n < pkt_size:
+                    continue
+                r_seq, s_ns, magic = unpack_from(buf)
+                if magic != MAGIC:
+                    continue
+                slot = r_seq % win_size
+                # the echoed stamp must match the slot's: filters duplicates
+                # and echoes of seqs that already left the window
+                if sent_ns[slot] != s_ns or recv_bits[slot]:
+                    continue
+                recv_bits[slot] = 1
+                recv_in_window += 1
+                rtt_ms = (recv_ns - sent_ns[slot]) / 1e6
+                oneway_ms = rtt_ms / 2.0
+                total_recv += 1
+                rtt_mean += (rtt_ms - rtt_mean) / total_recv
+                rtt_buf[rtt_idx] = rtt_ms
+                rtt_idx = rtt_idx + 1 if rtt_idx + 1 < win_size else 0
+
+                transit_ns = recv_ns - s_ns
+                if last_transit_ns is not None:
+                    d_ns = abs(transit_ns - last_transit_ns)
+                    J_ns += (d_ns - J_ns) >> 4
+                    d_sum += d_ns
+                    d_count += 1
+                    d_buf[d_idx] = d_ns
+                    d_idx = d_idx + 1 if d_idx + 1 < win_size else 0
+                    d_total += 1
+                last_transit_ns = transit_ns
+
+                loss_pct = 100*(sent_in_window-recv_in_window)/sent_in_window
+
+                if csv_file:
+                    if ewma_jitter:
+                        jit_ms = J_ns/1e6
+                    else:
+                        jit_ms = d_sum/d_count/1e6 if d_count else 0.0
+                    if recv_ns >= next_mos_ns and total_recv > 2:
+                        # OWD over the last pps samples, read back from the RTT ring
+                        n_owd = min(total_recv, pps)
+                        avg_oneway = sum(ring_tail(rtt_buf, rtt_idx, n_owd)) / n_owd / 2.0
+                        mos,R,Id,Ie_eff = emodel_mos_core(avg_oneway, loss_pct, Ie, Bpl, burstR)
+                        mos_cols = f"{mos:.3f},{R:.1f},{Id:.3f},{Ie_eff:.3f}"
+                        next_mos_ns = recv_ns + mos_interval_ns
+                    if csv_errors:
+                        raise csv_errors[0]
+                    if csv_backlog() < CSV_MAX_BACKLOG:
+                        put_row((wall_time(), r_seq, rtt_ms, oneway_ms, jit_ms, loss_pct, mos_cols))
+                    else:
+                        csv_dropped += 1
+
+            if now_ns >= next_report_ns:
+                avg_rtt = rtt_mean
+                avg_oneway = avg_rtt/2.0
+                p50, p90, p99 = percentiles(rtt_buf[:min(total_recv, win_size)], (50, 90, 99))
                 loss_total = 100*(total_sent-total_recv)/total_sent if total_sent else 0.0
-                win = list(window)
-                recv_win = sum(1 for w in win if w in received)
-                loss_win = 100*(len(win)-recv_win)/len(win) if win else 0.0
-
-                mos,R,Id,Ie_eff = emodel_mos(avg_oneway, loss_win, codec, burstR)
+                loss_win = 100*(sent_in_window-recv_in_window)/sent_in_window if sent_in_window else 0.0
+                if ewma_jitter:
+                    jit_ms = J_ns/1e6
+                else:
+                    jit_ms = d_sum/d_count/1e6 if d_count else 0.0
+                n_d = min(d_count if reset_jitter else d_total, win_size)
+                # percentiles and mean/sd/max of |D| share one sample set, built
+                # from the ring at report time rather than on the receive path
+                d_samples = ring_tail(d_buf, d_idx, n_d)
+                j50, j90, j99 = (v/1e6 for v in percentiles(d_samples, (50, 90, 99)))
+                if n_d:
+                    d_mean = sum(d_samples)/n_d
+                    d_sd = math.sqrt(max(0.0, sum(v*v for v in d_samples)/n_d - d_mean*d_mean))
+                    d_max = max(d_samples)
+                else:
+                    d_mean = d_sd = d_max = 0.0
+
+                mos,R,Id,Ie_eff = emodel_mos_core(avg_oneway, loss_win, Ie, Bpl, burstR)
                 print(
                     f"[stats] sent={total_sent} recv={total_recv} "
                     f"loss_total={loss_total:.2f}% loss_win={loss_win:.2f}% "
-                    f"RTT_avg={avg_rtt:.2f}ms OWD_avg~={avg_oneway:.2f}ms "
-                    f"jitter={J_ms:.2f}ms MOS≈{mos:.2f}"
+                    f"RTT_avg={avg_rtt:.2f}ms RTT_p50/p90/p99={p50:.2f}/{p90:.2f}/{p99:.2f}ms "
+                    f"OWD_avg~={avg_oneway:.2f}ms "
+                    f"jitter={jit_ms:.2f}ms |D|_p50/p90/p99={j50:.2f}/{j90:.2f}/{j99:.2f}ms "
+                    f"|D|_mean/sd/max={d_mean/1e6:.2f}/{d_sd/1e6:.2f}/{d_max/1e6:.2f}ms "
+                    f"MOS≈{mos:.2f}"
                 )
-                next_report += report_every
+                if reset_jitter:
+                    d_sum = d_count = 0
+                next_report_ns += report_ns
+
+            # send everything due in one go (catches up after a stall), but
+            # don't burst more than a second's worth after e.g. a suspend
+            if now_ns - next_send_ns > 1_000_000_000:
+                next_send_ns = now_ns - 1_000_000_000
+            while now_ns >= next_send_ns:
+                slot = seq % win_size
+                if sent_ns[slot] >= 0:
+                    # evict the seq falling out of the window
+                    sent_in_window -= 1
+                    recv_in_window -= recv_bits[slot]
+                    sent_ns[slot] = -1
+                    recv_bits[slot] = 0
+                send_ns = monotonic_ns()
+                pack_seq_ts(pkt, 0, seq, send_ns)
+                try:
+                    try:
+                        sock.send(pkt)
+                    except ConnectionRefusedError:
+                        # a pending ICMP error for an earlier probe was reported
+                        # instead of sending; reporting cleared it, so retry once
+                        sock.send(pkt)
+                    sent_ns[slot] = send_ns
+                    sent_in_window += 1
+                    total_sent += 1
+                except Exception as err:
+                    print("send error:", err)
+                seq = (seq + 1) & 0xffffffff
+                next_send_ns += interval_ns
 
-            time.sleep(0.0003)
+            # sleep until a packet arrives or the next send/report is due
+            deadline_ns = min(next_send_ns, next_report_ns)
+            if end_ns:
+                deadline_ns = min(deadline_ns, end_ns)
+            wait_ns = deadline_ns - monotonic_ns()
+            if wait_ns > 0:
+                sel.select(min(wait_ns / 1e9, max_wait))
 
     except KeyboardInterrupt:
         print("\n[client] interrupted")
 
     finally:
-        if csv_file:
-            csv_file.close()
+        close_err = None
+        if csv_thread:
+            rowq.put(None)
+            csv_thread.join()
+            try:
+                csv_file.close()
+            except OSError as err:
+                close_err = err
+        sel.close()
         sock.close()
+        if csv_dropped:
+            print(f"[client] csv writer fell behind, dropped {csv_dropped} rows")
         print("[client] stopped")
+        # a writer error already raised from the loop takes precedence
+        if close_err is not None and not csv_errors:
+            raise close_err
+    if csv_errors:
+        raise csv_errors[0]
 
 def main():
     parser = argparse.ArgumentParser()
@@ -220,6 +512,7 @@ def main():
     sp = sub.add_parser("server")
     sp.add_argument("--bind", default="0.0.0.0")
     sp.add_argument("--port", type=int, default=5005)
+    sp.add_argument("--cpu-affinity", type=int, default=None)
 
     cp = sub.add_parser("client")
     cp.add_argument("--host", required=True)
@@ -232,18 +525,23 @@ def main():
     cp.add_argument("--warmup", type=int, default=3)
     cp.add_argument("--report-every", type=int, default=5)
     cp.add_argument("--timeout-ms", type=int, default=200)
+    cp.add_argument("--cpu-affinity", type=int, default=None)
+    cp.add_argument("--mos-interval", type=float, default=1.0)
+    cp.add_argument("--jitter-algo", default="rfc3550", choices=JITTER_ALGOS)
 
     args = parser.parse_args()
 
     if args.mode == "server":
-        run_server(args.bind, args.port)
+        run_server(args.bind, args.port, args.cpu_affinity)
     else:
         run_client(
             args.host, args.port, args.pps,
             args.duration if args.duration>0 else None,
             args.csv, args.codec,
             args.burstR, args.warmup,
-            args.report_every, args.timeout_ms
+            args.report_every, args.timeout_ms,
+            args.cpu_affinity, args.mos_interval,
+            args.jitter_algo
         )
 
 if __name__ == "__main__":